@@ -1,8 +1,19 @@
+import asyncio
 import logging
 import os
+import sys
+import threading
+import csv
+import io
+import heapq
 import json
-from datetime import time as dtime
-from typing import Dict, Any
+import re
+import tempfile
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import date, datetime, timedelta, time as dtime
+from itertools import islice, takewhile
+from typing import Dict, Any, List, Optional, Tuple
 import pytz
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -16,20 +27,90 @@ from telegram.ext import (
 )
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not TOKEN:
-    raise RuntimeError("خطأ: التوكن مش موجود في متغير البيئة TELEGRAM_BOT_TOKEN")
 
-CAIRO_TZ = pytz.timezone('Africa/Cairo')
+DEFAULT_TZ_NAME = "Africa/Cairo"
+
+# المناطق الزمنية المتاحة للاختيار من قائمة القناة
+COMMON_TIMEZONES = [
+    "Africa/Cairo",
+    "Asia/Riyadh",
+    "Asia/Dubai",
+    "Asia/Baghdad",
+    "Africa/Casablanca",
+    "Africa/Algiers",
+    "Europe/Istanbul",
+    "Europe/London",
+    "Europe/Berlin",
+    "America/New_York",
+    "UTC",
+]
+
+# أعمدة ملفات الاستيراد/التصدير (JSONL و CSV بنفس الحقول)
+JOB_FIELDS = ["chat_id", "id", "text", "photo", "time", "days", "user_id", "paused", "counter"]
+IMPORT_BATCH_SIZE = 500
+SCHEDULE_CHUNK_SIZE = 200
+IMPORT_SAVE_ERROR = "فشل حفظ البيانات، لم يتم استيراد أي رسالة"
+
+# عدد الأيام اللي بنحسب لها أوقات الإرسال مقدماً بتوقيت UTC
+FIRE_TABLE_DAYS = 14
+# كل إرسال بيجدول اللي بعده، فلو اتأخر لازم يتنفذ متأخر بدل ما APScheduler يسقطه (الافتراضي ثانية واحدة)
+FIRE_JOB_KWARGS = {"misfire_grace_time": None, "coalesce": True}
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 
 DATA_FILE = "data.json"
+DATA_LOCK = threading.Lock()
+DATA_STATE: Dict[str, int] = {"generation": 0, "written": 0}
 CHANNELS: Dict[int, Dict[str, Any]] = {}
 USER_STATE: Dict[int, Dict[str, Any]] = {}
+FIRE_TABLES: Dict[str, Dict[str, Any]] = {}
+# فهرس الإرسال القادم لكل قناة: [(next_fire_utc, chat_id, job_id)] مترتب بالوقت
+FIRE_INDEX: Dict[int, List[Tuple[datetime, int, int]]] = {}
+NEXT_FIRES: Dict[Tuple[int, int], datetime] = {}
+INDEX_JOBS: Dict[Tuple[int, int], dict] = {}
+UPCOMING_LIMIT = 20
+
+# سجل الإرسال: سطر لكل إرسال [chat_id, job_id, scheduled_ts, latency_ms, message_id, ok, sent_ts]
+HISTORY_FILE = "history.jsonl"
+STATS_FILE = "stats.json"
+HISTORY_RETENTION_DAYS = 30
+ROLLUP_RETENTION_DAYS = 365
+STATS_FLUSH_SECONDS = 300
+STATS_MAX_JOBS = 40
+# {chat_id: {job_id: {"YYYY-MM-DD": [sent, failed, latency_ms_sum]}}} بتوقيت UTC
+DAILY_ROLLUPS: Dict[int, Dict[int, Dict[str, List[int]]]] = {}
+# {chat_id: {job_id: [sent, failed, latency_ms_sum]}} مجموع كل الأيام المحفوظة
+JOB_TOTALS: Dict[int, Dict[int, List[int]]] = {}
+STATS_STATE: Dict[str, Any] = {"flushed_at": 0.0, "dirty": False}
+
+TEMPLATE_HELP = (
+    "متغيرات ممكن تستخدمها في النص:\n"
+    "{date} التاريخ، {weekday_ar} اسم اليوم، {hijri_date} التاريخ الهجري، {counter} رقم مرة الإرسال"
+)
+
+IMPORT_PROMPT = (
+    "ابعت ملف JSONL أو CSV فيه الرسائل.\n\n"
+    "الحقول: text, photo, time (HH:MM), days (أرقام 0-6 تبدأ بالاثنين), paused, counter\n"
+    "لو في الملف chat_id لقناة تانية بيتجاهل والرسائل بتتضاف للقناة دي.\n"
+    'مثال JSONL: {"text": "صباح الخير", "time": "08:00", "days": [0, 1, 2]}'
+)
 
 WEEKDAYS_AR = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+HIJRI_MONTHS_AR = [
+    "محرم", "صفر", "ربيع الأول", "ربيع الآخر", "جمادى الأولى", "جمادى الآخرة",
+    "رجب", "شعبان", "رمضان", "شوال", "ذو القعدة", "ذو الحجة",
+]
+
+# متغيرات القوالب اللي ممكن تتكتب في نص الرسالة
+TEMPLATE_FIELDS = ("date", "weekday_ar", "counter", "hijri_date")
+TEMPLATE_RE = re.compile(r"\{(" + "|".join(TEMPLATE_FIELDS) + r")\}")
+# عداد {counter} لكل رسالة: (chat_id, job_id) -> عدد مرات الإرسال. بيتحفظ في data.json على فترات
+JOB_COUNTERS: Dict[Tuple[int, int], int] = {}
+COUNTERS_STATE: Dict[str, bool] = {"dirty": False}
+# التاريخ المحلي -> {"values": قيم اليوم, "texts": {نص القالب: الناتج}}
+RENDER_CACHE: Dict[date, Dict[str, Any]] = {}
 
 
 def format_time_12h(hour: int, minute: int) -> str:
@@ -49,6 +130,71 @@ def parse_time_12h(hour_12: int, period: str) -> int:
         return 12 if hour_12 == 12 else hour_12 + 12
 
 
+def gregorian_to_hijri(day: date) -> Tuple[int, int, int]:
+    """تحويل تاريخ ميلادي لهجري بالتقويم الحسابي (ممكن يفرق يوم عن رؤية الهلال)"""
+    l = day.toordinal() + 1721425 - 1948440 + 10632
+    n = (l - 1) // 10631
+    l = l - 10631 * n + 354
+    j = ((10985 - l) // 5316) * ((50 * l) // 17719) + (l // 5670) * ((43 * l) // 15238)
+    l = l - ((30 - j) // 15) * ((17719 * j) // 50) - (j // 16) * ((15238 * j) // 43) + 29
+    month = (24 * l) // 709
+    return 30 * n + j - 30, month, l - (709 * month) // 24
+
+
+def compile_template(text: str) -> Optional[tuple]:
+    """تقسيم النص لأجزاء ثابتة ومتغيرات، وترجع None لو النص مفيهوش متغيرات.
+    بيتنادى مرة واحدة لما الرسالة تتحفظ والناتج بيتخزن في job["template"]"""
+    if not text:
+        return None
+    parts = []
+    pos = 0
+    for m in TEMPLATE_RE.finditer(text):
+        parts.append((text[pos:m.start()], m.group(1)))
+        pos = m.end()
+    if not parts:
+        return None
+    uses_counter = any(field == "counter" for _, field in parts)
+    return (text, tuple(parts), text[pos:], uses_counter)
+
+
+def _day_values(day: date) -> Dict[str, str]:
+    h_year, h_month, h_day = gregorian_to_hijri(day)
+    return {
+        "date": f"{day.day}/{day.month}/{day.year}",
+        "weekday_ar": WEEKDAYS_AR[day.weekday()],
+        "hijri_date": f"{h_day} {HIJRI_MONTHS_AR[h_month - 1]} {h_year}هـ",
+    }
+
+
+def render_template(template: tuple, day: date, counter: int = 0) -> str:
+    """تطبيق القالب على يوم معين. الناتج بيتخزن لكل يوم ويتشارك بين كل القنوات اللي بتستخدم نفس القالب"""
+    source, parts, tail, _ = template
+    day_cache = RENDER_CACHE.get(day)
+    if day_cache is None:
+        for old in [d for d in RENDER_CACHE if d < day - timedelta(days=1)]:
+            del RENDER_CACHE[old]
+        day_cache = RENDER_CACHE[day] = {"values": _day_values(day), "texts": {}}
+
+    rendered = day_cache["texts"].get(source)
+    if rendered is None:
+        # العداد بيختلف من رسالة للتانية، فبنخزن الأجزاء اللي حواليه ونلزقها وقت الإرسال
+        values = day_cache["values"]
+        segments = [""]
+        for literal, field in parts:
+            segments[-1] += literal
+            if field == "counter":
+                segments.append("")
+            else:
+                segments[-1] += values[field]
+        segments[-1] += tail
+        rendered = segments[0] if len(segments) == 1 else tuple(segments)
+        day_cache["texts"][source] = rendered
+
+    if isinstance(rendered, str):
+        return rendered
+    return str(counter).join(rendered)
+
+
 def load_data():
     global CHANNELS
     try:
@@ -63,6 +209,7 @@ def load_data():
         return
 
     CHANNELS = {}
+    JOB_COUNTERS.clear()
     for cid_str, info in raw.items():
         cid = int(cid_str)
         jobs = []
@@ -77,36 +224,463 @@ def load_data():
                     "days": tuple(job["days"]),
                     "user_id": job["user_id"],
                     "paused": job.get("paused", False),
+                    "template": compile_template(job["text"]),
+                }
+            )
+            if job.get("counter"):
+                JOB_COUNTERS[(cid, job["id"])] = job["counter"]
+        CHANNELS[cid] = {
+            "title": info.get("title", "قناة"),
+            "tz": _valid_tz_name(cid, info.get("tz", DEFAULT_TZ_NAME)),
+            "next_id": max(info.get("next_id") or 1, max((j["id"] for j in jobs), default=0) + 1),
+            "jobs": jobs,
+        }
+
+
+def _valid_tz_name(chat_id: int, tz_name: Any) -> str:
+    try:
+        pytz.timezone(tz_name)
+        return tz_name
+    except (pytz.UnknownTimeZoneError, AttributeError, TypeError):
+        logging.warning("منطقة زمنية غير معروفة %r للقناة %s، هنستخدم %s", tz_name, chat_id, DEFAULT_TZ_NAME)
+        return DEFAULT_TZ_NAME
+
+
+def serialize_data() -> Tuple[int, Dict[str, Any]]:
+    """نسخة من CHANNELS جاهزة للكتابة في data.json، مع رقم نسخة عشان نسخة قديمة متكتبش فوق أحدث منها"""
+    out = {}
+    for cid, info in CHANNELS.items():
+        jobs = []
+        for job in info["jobs"]:
+            jobs.append(
+                {
+                    "id": job["id"],
+                    "text": job["text"],
+                    "photo": job.get("photo"),
+                    "time": job["time"].strftime("%H:%M"),
+                    "days": list(job["days"]),
+                    "user_id": job["user_id"],
+                    "paused": job.get("paused", False),
+                    "counter": JOB_COUNTERS.get((cid, job["id"]), 0),
                 }
             )
-        CHANNELS[cid] = {"title": info.get("title", "قناة"), "jobs": jobs}
+        out[str(cid)] = {
+            "title": info["title"],
+            "tz": info.get("tz", DEFAULT_TZ_NAME),
+            "next_id": info.get("next_id") or max((j["id"] for j in info["jobs"]), default=0) + 1,
+            "jobs": jobs,
+        }
+    DATA_STATE["generation"] += 1
+    COUNTERS_STATE["dirty"] = False
+    return DATA_STATE["generation"], out
+
+
+def write_data(generation: int, out: Dict[str, Any]) -> bool:
+    """كتابة نسخة من serialize_data. آمنة من thread تاني (asyncio.to_thread)"""
+    try:
+        with DATA_LOCK:
+            if generation < DATA_STATE["written"]:
+                return True
+            # الكتابة في ملف مؤقت ثم استبداله عشان الحفظ يا يتم كله يا ميتمش
+            tmp_path = DATA_FILE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(out, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, DATA_FILE)
+            DATA_STATE["written"] = generation
+        return True
+    except Exception as e:
+        logging.error("فشل الحفظ: %s", e)
+        COUNTERS_STATE["dirty"] = True
+        return False
 
 
 def save_data():
     try:
-        out = {}
-        for cid, info in CHANNELS.items():
-            jobs = []
-            for job in info["jobs"]:
-                jobs.append(
-                    {
-                        "id": job["id"],
-                        "text": job["text"],
-                        "photo": job.get("photo"),
-                        "time": job["time"].strftime("%H:%M"),
-                        "days": list(job["days"]),
-                        "user_id": job["user_id"],
-                        "paused": job.get("paused", False),
-                    }
-                )
-            out[str(cid)] = {"title": info["title"], "jobs": jobs}
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(out, f, ensure_ascii=False, indent=2)
+        generation, out = serialize_data()
     except Exception as e:
         logging.error("فشل الحفظ: %s", e)
+        return False
+    return write_data(generation, out)
+
+
+def job_to_row(chat_id: int, job: dict) -> Dict[str, Any]:
+    return {
+        "chat_id": chat_id,
+        "id": job["id"],
+        "text": job["text"],
+        "photo": job.get("photo"),
+        "time": job["time"].strftime("%H:%M"),
+        "days": list(job["days"]),
+        "user_id": job["user_id"],
+        "paused": job.get("paused", False),
+        "counter": JOB_COUNTERS.get((chat_id, job["id"]), 0),
+    }
+
+
+def _parse_int(value: Any, error: str) -> int:
+    """تحويل قيمة من ملف الاستيراد لرقم صحيح (true/false مش أرقام)، ويرمي ValueError برسالة error"""
+    if isinstance(value, bool):
+        raise ValueError(error)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and re.fullmatch(r"\s*-?\d+\s*", value):
+        return int(value)
+    raise ValueError(error)
+
+
+def parse_job_row(row: Any, chat_id: Optional[int] = None, user_id: int = 0) -> Tuple[int, dict]:
+    """تحويل سطر من ملف الاستيراد إلى (chat_id, job)، ويرمي ValueError لو البيانات غلط.
+    لو chat_id متحدد كل السطور بتروح للقناة دي وchat_id اللي في السطر بيتجاهل (نقل/نسخ الرسائل بين القنوات)"""
+    if not isinstance(row, dict):
+        raise ValueError("السطر لازم يكون object")
+
+    if chat_id is not None:
+        cid = chat_id
+    elif row.get("chat_id") in (None, ""):
+        raise ValueError("chat_id مطلوب")
+    else:
+        cid = _parse_int(row["chat_id"], "chat_id لازم يكون رقم")
+
+    text = row.get("text") or ""
+    photo = row.get("photo") or None
+    if not isinstance(text, str):
+        raise ValueError("النص لازم يكون نص")
+    if photo is not None and not isinstance(photo, str):
+        raise ValueError("الصورة لازم تكون file_id")
+    if not text and not photo:
+        raise ValueError("لازم نص أو صورة")
+
+    raw_time = row.get("time")
+    match = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*", raw_time) if isinstance(raw_time, str) else None
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError("الوقت لازم يكون بصيغة HH:MM (من 00:00 لـ 23:59)")
+    h, m = int(match.group(1)), int(match.group(2))
+
+    raw_days = row.get("days")
+    if isinstance(raw_days, str):
+        raw_days = [d for d in raw_days.replace(";", ",").split(",") if d.strip()]
+    if not isinstance(raw_days, list):
+        raise ValueError("الأيام لازم تكون قائمة أرقام من 0 لـ 6")
+    days = sorted({_parse_int(d, "الأيام لازم تكون أرقام من 0 لـ 6") for d in raw_days})
+    if not days or days[0] < 0 or days[-1] > 6:
+        raise ValueError("الأيام لازم تكون أرقام من 0 لـ 6")
+
+    paused = row.get("paused")
+    if paused in (None, ""):
+        paused = False
+    elif isinstance(paused, str):
+        paused = paused.strip().lower() in ("1", "true", "yes")
+    elif not isinstance(paused, (bool, int)):
+        raise ValueError("paused لازم يكون true أو false")
+
+    raw_user = row.get("user_id")
+    row_user_id = user_id if raw_user in (None, "") else _parse_int(raw_user, "user_id لازم يكون رقم")
+
+    raw_counter = row.get("counter")
+    counter = 0 if raw_counter in (None, "") else _parse_int(raw_counter, "counter لازم يكون رقم")
+    if counter < 0:
+        raise ValueError("counter لازم يكون رقم موجب")
+
+    return cid, {
+        "id": None,
+        "text": text,
+        "photo": photo,
+        "time": dtime(h, m),
+        "days": tuple(days),
+        "user_id": row_user_id,
+        "paused": bool(paused),
+        "template": compile_template(text),
+        "counter": counter,
+    }
+
+
+def _job_key(job: dict) -> tuple:
+    return (job["text"], job.get("photo"), job["time"], tuple(job["days"]))
+
+
+def iter_import_rows(fp, fmt: str):
+    """قراءة ملف الاستيراد سطر بسطر من غير ما نحمله كله في الذاكرة"""
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(fp), start=2):
+            yield line_no, row
+        return
+    for line_no, line in enumerate(fp, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+
+def prepare_import(fp, fmt: str, chat_id: Optional[int] = None, user_id: int = 0):
+    """قراءة ملف الاستيراد والتحقق منه وإزالة التكرار على دفعات من غير ما نعدل CHANNELS.
+    بيرجع (الرسائل الجديدة [(chat_id, job)]، عدد المكرر، الأخطاء)"""
+    seen: Dict[int, set] = {}
+    pending: List[Tuple[int, dict]] = []
+    duplicates = 0
+    errors: List[str] = []
+
+    rows = iter_import_rows(fp, fmt)
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        for line_no, row in batch:
+            try:
+                cid, job = parse_job_row(row, chat_id, user_id)
+            except ValueError as e:
+                errors.append(f"سطر {line_no}: {e}")
+                continue
+            keys = seen.get(cid)
+            if keys is None:
+                keys = seen[cid] = {_job_key(j) for j in list(CHANNELS.get(cid, {}).get("jobs", []))}
+            key = _job_key(job)
+            if key in keys:
+                duplicates += 1
+                continue
+            keys.add(key)
+            pending.append((cid, job))
+    return pending, duplicates, errors
+
+
+def allocate_job_id(chat_id: int) -> int:
+    """id جديد للرسالة. الـ ids مبتترجعش تاني بعد الحذف عشان إحصائيات الرسالة المحذوفة متتنسبش لرسالة جديدة"""
+    channel = CHANNELS[chat_id]
+    job_id = channel.get("next_id") or max((j["id"] for j in channel["jobs"]), default=0) + 1
+    channel["next_id"] = job_id + 1
+    return job_id
+
+
+def read_import_file(path: str, fmt: str, chat_id: Optional[int] = None, user_id: int = 0):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return prepare_import(f, fmt, chat_id, user_id)
+
+
+def apply_import(pending: List[Tuple[int, dict]]):
+    """إضافة الرسائل لـ CHANNELS مرة واحدة، وترجع دالة بترجع كل حاجة زي ما كانت لو الحفظ فشل"""
+    original_sizes: Dict[int, int] = {}
+    original_next_ids: Dict[int, Optional[int]] = {}
+    created = set()
+    for cid, job in pending:
+        if cid not in CHANNELS:
+            CHANNELS[cid] = {"title": f"قناة_{cid}", "tz": DEFAULT_TZ_NAME, "jobs": []}
+            created.add(cid)
+        jobs = CHANNELS[cid]["jobs"]
+        if cid not in original_sizes:
+            original_sizes[cid] = len(jobs)
+            original_next_ids[cid] = CHANNELS[cid].get("next_id")
+        job["id"] = allocate_job_id(cid)
+        counter = job.pop("counter", 0)
+        if counter:
+            JOB_COUNTERS[(cid, job["id"])] = counter
+        jobs.append(job)
+
+    def undo():
+        for cid, size in original_sizes.items():
+            for job in CHANNELS[cid]["jobs"][size:]:
+                JOB_COUNTERS.pop((cid, job["id"]), None)
+            del CHANNELS[cid]["jobs"][size:]
+            CHANNELS[cid]["next_id"] = original_next_ids[cid]
+        for cid in created:
+            CHANNELS.pop(cid, None)
+
+    return undo
+
+
+def import_jobs(fp, fmt: str, chat_id: Optional[int] = None, user_id: int = 0):
+    """استيراد رسائل من ملف JSONL/CSV: تحقق وإزالة تكرار على دفعات ثم حفظ واحد لكل الرسائل.
+    بيرجع (الرسائل المضافة [(chat_id, job)]، عدد المكرر، الأخطاء)"""
+    pending, duplicates, errors = prepare_import(fp, fmt, chat_id, user_id)
+    if not pending:
+        return [], duplicates, errors
+
+    undo = apply_import(pending)
+    if not save_data():
+        undo()
+        errors.append(IMPORT_SAVE_ERROR)
+        return [], duplicates, errors
+    return pending, duplicates, errors
+
+
+def export_jobs(fp, fmt: str, chat_id: Optional[int] = None) -> int:
+    """كتابة الرسائل في fp بصيغة JSONL أو CSV سطر بسطر، وترجع عدد الرسائل"""
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(fp, fieldnames=JOB_FIELDS)
+        writer.writeheader()
+
+    count = 0
+    channels = [(chat_id, CHANNELS.get(chat_id, {}))] if chat_id is not None else CHANNELS.items()
+    for cid, info in channels:
+        for job in info.get("jobs", []):
+            row = job_to_row(cid, job)
+            if writer:
+                row["days"] = ",".join(map(str, row["days"]))
+                row["photo"] = row["photo"] or ""
+                row["paused"] = "true" if row["paused"] else "false"
+                writer.writerow(row)
+            else:
+                fp.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def detect_format(filename: str) -> str:
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def _apply_delivery(chat_id: int, job_id: int, scheduled_ts: float, latency_ms: int, ok: bool):
+    day = datetime.fromtimestamp(scheduled_ts, pytz.utc).strftime("%Y-%m-%d")
+    rollup = DAILY_ROLLUPS.setdefault(chat_id, {}).setdefault(job_id, {}).setdefault(day, [0, 0, 0])
+    totals = JOB_TOTALS.setdefault(chat_id, {}).setdefault(job_id, [0, 0, 0])
+    idx = 0 if ok else 1
+    rollup[idx] += 1
+    totals[idx] += 1
+    if ok:
+        rollup[2] += latency_ms
+        totals[2] += latency_ms
+
+
+def _rebuild_totals():
+    JOB_TOTALS.clear()
+    for cid, jobs in DAILY_ROLLUPS.items():
+        for job_id, days in jobs.items():
+            totals = JOB_TOTALS.setdefault(cid, {}).setdefault(job_id, [0, 0, 0])
+            for sent, failed, latency in days.values():
+                totals[0] += sent
+                totals[1] += failed
+                totals[2] += latency
+
+
+def load_stats():
+    """تحميل الملخصات اليومية، ثم إعادة تطبيق سطور السجل اللي اتكتبت بعد آخر حفظ"""
+    DAILY_ROLLUPS.clear()
+    try:
+        with open(STATS_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        STATS_STATE["flushed_at"] = raw.get("flushed_at", 0.0)
+        for cid_str, jobs in raw.get("rollups", {}).items():
+            DAILY_ROLLUPS[int(cid_str)] = {int(jid): days for jid, days in jobs.items()}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error("فشل قراءة %s: %s", STATS_FILE, e)
+    _rebuild_totals()
+
+    flushed_at = STATS_STATE["flushed_at"]
+    replayed = 0
+    try:
+        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    cid, job_id, scheduled_ts, latency_ms, _, ok = row[:6]
+                except (ValueError, TypeError):
+                    continue
+                # السطور القديمة مفيهاش sent_ts فبنقدره من الوقت المجدول والتأخير
+                sent_ts = row[6] if len(row) > 6 else scheduled_ts + latency_ms / 1000
+                if sent_ts > flushed_at:
+                    _apply_delivery(cid, job_id, scheduled_ts, latency_ms, bool(ok))
+                    replayed += 1
+    except FileNotFoundError:
+        pass
+    if replayed:
+        STATS_STATE["dirty"] = True
+        logging.info("Replayed %d deliveries from %s", replayed, HISTORY_FILE)
+
+    # بيانات قديمة من قبل next_id: منرجعش نستخدم id لسه ليه إحصائيات
+    for cid, totals in JOB_TOTALS.items():
+        channel = CHANNELS.get(cid)
+        if channel and totals:
+            channel["next_id"] = max(channel.get("next_id") or 1, max(totals) + 1)
+
+
+def save_stats():
+    try:
+        flushed_at = datetime.now(pytz.utc).timestamp()
+        out = {
+            "flushed_at": flushed_at,
+            "rollups": {
+                str(cid): {str(jid): days for jid, days in jobs.items()}
+                for cid, jobs in DAILY_ROLLUPS.items()
+            },
+        }
+        tmp_path = STATS_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(out, f, separators=(",", ":"))
+        os.replace(tmp_path, STATS_FILE)
+        STATS_STATE["flushed_at"] = flushed_at
+        STATS_STATE["dirty"] = False
+    except Exception as e:
+        logging.error("فشل حفظ الإحصائيات: %s", e)
+
+
+def record_delivery(chat_id: int, job_id: int, scheduled_at: datetime, message_id: Optional[int], ok: bool):
+    """إضافة سطر لسجل الإرسال وتحديث الملخص اليومي ومجموع الرسالة"""
+    sent_ts = datetime.now(pytz.utc).timestamp()
+    scheduled = scheduled_at.timestamp() if scheduled_at else sent_ts
+    scheduled_ts = int(scheduled)
+    latency_ms = max(0, int((sent_ts - scheduled) * 1000))
+    try:
+        with open(HISTORY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps([chat_id, job_id, scheduled_ts, latency_ms, message_id, int(ok), sent_ts]) + "\n")
+    except Exception as e:
+        logging.error("فشل كتابة سجل الإرسال: %s", e)
+    _apply_delivery(chat_id, job_id, scheduled_ts, latency_ms, ok)
+    STATS_STATE["dirty"] = True
+
+
+def prune_history():
+    """حذف سطور السجل الأقدم من HISTORY_RETENTION_DAYS والملخصات الأقدم من ROLLUP_RETENTION_DAYS"""
+    now = datetime.now(pytz.utc)
+    cutoff_ts = (now - timedelta(days=HISTORY_RETENTION_DAYS)).timestamp()
+    kept = dropped = 0
+    try:
+        tmp_path = HISTORY_FILE + ".tmp"
+        with open(HISTORY_FILE, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                # السطور التالفة (مش list أو الوقت مش رقم) بتتشال
+                if not isinstance(row, list) or len(row) < 3 or not isinstance(row[2], (int, float)):
+                    dropped += 1
+                    continue
+                scheduled_ts = row[2]
+                if scheduled_ts >= cutoff_ts:
+                    dst.write(line)
+                    kept += 1
+                else:
+                    dropped += 1
+        os.replace(tmp_path, HISTORY_FILE)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error("فشل تنظيف سجل الإرسال: %s", e)
+        if os.path.exists(HISTORY_FILE + ".tmp"):
+            os.remove(HISTORY_FILE + ".tmp")
+
+    cutoff_day = (now - timedelta(days=ROLLUP_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    for cid in list(DAILY_ROLLUPS):
+        jobs = DAILY_ROLLUPS[cid]
+        for job_id in list(jobs):
+            days = jobs[job_id]
+            for day in [d for d in days if d < cutoff_day]:
+                del days[day]
+            if not days:
+                del jobs[job_id]
+        if not jobs:
+            del DAILY_ROLLUPS[cid]
+    _rebuild_totals()
+    save_stats()
+    logging.info("Pruned delivery history: kept %d, dropped %d", kept, dropped)
 
 
 load_data()
+load_stats()
 
 
 def get_main_menu(user_id: int) -> InlineKeyboardMarkup:
@@ -122,25 +696,234 @@ def get_channel_menu(chat_id: int) -> InlineKeyboardMarkup:
         [
             [InlineKeyboardButton("إضافة رسالة", callback_data=f"addmsg_{chat_id}")],
             [InlineKeyboardButton("عرض الرسائل", callback_data=f"list_{chat_id}")],
+            [InlineKeyboardButton("🗓️ المنشورات القادمة", callback_data=f"timeline_{chat_id}")],
+            [InlineKeyboardButton("📊 إحصائيات", callback_data=f"stats_{chat_id}")],
+            [InlineKeyboardButton("🌍 المنطقة الزمنية", callback_data=f"tz_{chat_id}")],
+            [
+                InlineKeyboardButton("📥 استيراد", callback_data=f"import_{chat_id}"),
+                InlineKeyboardButton("📤 تصدير", callback_data=f"export_{chat_id}"),
+            ],
             [InlineKeyboardButton("رجوع", callback_data="back")],
         ]
     )
 
 
+def get_channel_tz_name(chat_id: int) -> str:
+    return CHANNELS.get(chat_id, {}).get("tz", DEFAULT_TZ_NAME)
+
+
+def compute_fire_times(tz_name: str, at: dtime, days, start: date, end: date) -> List[Tuple[datetime, date]]:
+    """حساب أوقات الإرسال (UTC، التاريخ المحلي) من start لحد end (من غير end) مع مراعاة التوقيت الصيفي"""
+    tz = pytz.timezone(tz_name)
+    fires = []
+    day = start
+    while day < end:
+        if day.weekday() in days:
+            naive = datetime.combine(day, at)
+            try:
+                local = tz.localize(naive, is_dst=None)
+            except pytz.AmbiguousTimeError:
+                # الساعة بتتكرر عند الرجوع للتوقيت الشتوي: نبعت في أول مرة بس
+                local = tz.localize(naive, is_dst=True)
+            except pytz.NonExistentTimeError:
+                # الساعة مش موجودة عند بداية التوقيت الصيفي: بنأخرها بمقدار فرق التوقيت (02:30 تبقى 03:30)
+                local = tz.normalize(tz.localize(naive, is_dst=False))
+            fires.append((local.astimezone(pytz.utc), day))
+        day += timedelta(days=1)
+    return fires
+
+
+def refresh_fire_table(chat_id: int, job: dict) -> deque:
+    """تحديث جدول أوقات الإرسال (UTC) للرسالة: إعادة بناء لو المنطقة أو الوقت أو الأيام اتغيرت، وإلا إضافة الأيام الجديدة بس"""
+    name = f"{chat_id}_{job['id']}"
+    tz_name = get_channel_tz_name(chat_id)
+    days = tuple(job["days"])
+    key = (tz_name, job["time"], days)
+
+    now = datetime.now(pytz.utc)
+    today = now.astimezone(pytz.timezone(tz_name)).date()
+    horizon = today + timedelta(days=FIRE_TABLE_DAYS)
+
+    table = FIRE_TABLES.get(name)
+    if table is None or table["key"] != key:
+        table = {"key": key, "fires": deque(), "until": today}
+        FIRE_TABLES[name] = table
+
+    fires = table["fires"]
+    if table["until"] < horizon:
+        start = max(table["until"], today)
+        fires.extend(compute_fire_times(tz_name, job["time"], days, start, horizon))
+        table["until"] = horizon
+    while fires and fires[0][0] <= now:
+        fires.popleft()
+    return fires
+
+
+def index_remove(chat_id: int, job_id: int):
+    INDEX_JOBS.pop((chat_id, job_id), None)
+    at = NEXT_FIRES.pop((chat_id, job_id), None)
+    if at is None:
+        return
+    entries = FIRE_INDEX.get(chat_id, [])
+    entry = (at, chat_id, job_id)
+    i = bisect_left(entries, entry)
+    if i < len(entries) and entries[i] == entry:
+        del entries[i]
+
+
+def index_set(chat_id: int, job_id: int, at: datetime, job: Optional[dict] = None):
+    """تحديث موعد الإرسال القادم للرسالة في الفهرس (حذف القديم وإدخال الجديد في مكانه)"""
+    job = job or INDEX_JOBS.get((chat_id, job_id))
+    index_remove(chat_id, job_id)
+    insort(FIRE_INDEX.setdefault(chat_id, []), (at, chat_id, job_id))
+    NEXT_FIRES[(chat_id, job_id)] = at
+    if job:
+        INDEX_JOBS[(chat_id, job_id)] = job
+
+
+def _index_from(index: List[Tuple[datetime, int, int]], now: datetime):
+    for k in range(bisect_left(index, (now,)), len(index)):
+        yield index[k]
+
+
+def upcoming_fires(chat_ids: List[int], limit: int = UPCOMING_LIMIT, hours: int = 24):
+    """أول limit إرسال خلال الساعات الجاية من الفهرس المترتب للقنوات دي، من غير ما نلف على كل الرسائل"""
+    now = datetime.now(pytz.utc)
+    end = now + timedelta(hours=hours)
+    sources = [_index_from(FIRE_INDEX.get(cid, []), now) for cid in chat_ids]
+    entries = sources[0] if len(sources) == 1 else heapq.merge(*sources)
+    return list(islice(takewhile(lambda e: e[0] <= end, entries), limit))
+
+
+def format_upcoming(entries: List[Tuple[datetime, int, int]], show_channel: bool) -> str:
+    zones: Dict[int, Any] = {}
+    lines = []
+    for at, cid, job_id in entries:
+        tz = zones.get(cid)
+        if tz is None:
+            tz = zones[cid] = pytz.timezone(get_channel_tz_name(cid))
+        local = at.astimezone(tz)
+        job = INDEX_JOBS.get((cid, job_id))
+        text = job["text"] if job else ""
+        label = text[:20] + "..." if len(text) > 20 else text
+        line = f"🕐 {WEEKDAYS_AR[local.weekday()]} {format_time_12h(local.hour, local.minute)} — #{job_id} {label}"
+        if show_channel:
+            line += f" ({CHANNELS.get(cid, {}).get('title', cid)})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def schedule_next_fire(application: Application, name: str, data: dict):
+    """جدولة الإرسال التالي من الجدول المحسوب مسبقاً من غير أي حسابات توقيت"""
+    table = FIRE_TABLES.get(name)
+    if table is None:
+        return
+    fires = table["fires"]
+    now = datetime.now(pytz.utc)
+    fired_at = max(now, data.get("fire_at") or now)
+    while fires and fires[0][0] <= fired_at:
+        fires.popleft()
+
+    chat_id, job_id = data["chat_id"], data["job_id"]
+    # لما يفضل أقل من أسبوع في الجدول نكمله (مرة كل كام يوم مش كل إرسال)
+    if len(fires) < len(table["key"][2]):
+        job = find_job(chat_id, job_id)
+        if not job or job.get("paused", False):
+            index_remove(chat_id, job_id)
+            return
+        fires = refresh_fire_table(chat_id, job)
+        while fires and fires[0][0] <= fired_at:
+            fires.popleft()
+
+    if not fires:
+        logging.warning("No upcoming fire times for job %s", name)
+        index_remove(chat_id, job_id)
+        return
+    application.job_queue.run_once(
+        send_job_callback,
+        when=fires[0][0],
+        name=name,
+        data={**data, "fire_at": fires[0][0], "fire_date": fires[0][1]},
+        job_kwargs=FIRE_JOB_KWARGS,
+    )
+    index_set(chat_id, job_id, fires[0][0])
+
+
+def find_job(chat_id: int, job_id: int) -> Optional[dict]:
+    return next((j for j in CHANNELS.get(chat_id, {}).get("jobs", []) if j["id"] == job_id), None)
+
+
 async def send_job_callback(context: ContextTypes.DEFAULT_TYPE):
     job_data = context.job.data or {}
     chat_id = job_data.get("chat_id")
     text = job_data.get("text")
     photo = job_data.get("photo")
-    
+    template = job_data.get("template")
+
+    schedule_next_fire(context.application, context.job.name, job_data)
+
+    counter_key = None
+    counter = 0
+    if template:
+        if template[3]:
+            counter_key = (chat_id, job_data.get("job_id"))
+            counter = JOB_COUNTERS.get(counter_key, 0) + 1
+        text = render_template(template, job_data["fire_date"], counter)
+
     if chat_id:
         try:
             if photo:
-                await context.bot.send_photo(chat_id=chat_id, photo=photo, caption=text)
+                message = await context.bot.send_photo(chat_id=chat_id, photo=photo, caption=text)
             elif text:
-                await context.bot.send_message(chat_id=chat_id, text=text)
+                message = await context.bot.send_message(chat_id=chat_id, text=text)
+            else:
+                return
+            record_delivery(chat_id, job_data.get("job_id"), job_data.get("fire_at"), message.message_id, True)
+            if counter_key:
+                JOB_COUNTERS[counter_key] = counter
+                COUNTERS_STATE["dirty"] = True
         except Exception as e:
             logging.error("فشل إرسال الرسالة للـchat %s : %s", chat_id, e)
+            record_delivery(chat_id, job_data.get("job_id"), job_data.get("fire_at"), None, False)
+
+
+async def flush_state_callback(context: ContextTypes.DEFAULT_TYPE):
+    """حفظ الإحصائيات وعدادات القوالب اللي اتغيرت من آخر حفظ"""
+    if STATS_STATE["dirty"]:
+        save_stats()
+    if COUNTERS_STATE["dirty"]:
+        save_data()
+
+
+async def prune_history_callback(context: ContextTypes.DEFAULT_TYPE):
+    prune_history()
+
+
+def _queue_first_fire(application: Application, chat_id: int, job: dict) -> Optional[datetime]:
+    """جدولة أول إرسال للرسالة من جدول أوقاتها وتحديث الفهرس، وترجع وقته أو None لو مفيش"""
+    fires = refresh_fire_table(chat_id, job)
+    if not fires:
+        logging.warning("No upcoming fire times for job %s_%s", chat_id, job["id"])
+        index_remove(chat_id, job["id"])
+        return None
+
+    application.job_queue.run_once(
+        send_job_callback,
+        when=fires[0][0],
+        name=f"{chat_id}_{job['id']}",
+        data={
+            "chat_id": chat_id,
+            "job_id": job["id"],
+            "text": job["text"],
+            "template": job.get("template"),
+            "photo": job.get("photo"),
+            "fire_at": fires[0][0],
+            "fire_date": fires[0][1],
+        },
+        job_kwargs=FIRE_JOB_KWARGS,
+    )
+    index_set(chat_id, job["id"], fires[0][0], job)
+    return fires[0][0]
 
 
 def schedule_job(application: Application, chat_id: int, job: dict):
@@ -150,20 +933,35 @@ def schedule_job(application: Application, chat_id: int, job: dict):
 
     if job.get("paused", False):
         logging.info("Job %s is paused, not scheduling", name)
+        index_remove(chat_id, job["id"])
         return
 
-    days_tuple = tuple(job["days"])
-    
-    time_with_tz = dtime(job["time"].hour, job["time"].minute, tzinfo=CAIRO_TZ)
-    
-    application.job_queue.run_daily(
-        send_job_callback, 
-        time=time_with_tz, 
-        days=days_tuple, 
-        name=name, 
-        data={"chat_id": chat_id, "text": job["text"], "photo": job.get("photo")}
-    )
-    logging.info("Scheduled job %s for chat %s at %s (Cairo time) on days %s", job["id"], chat_id, job["time"], days_tuple)
+    next_run = _queue_first_fire(application, chat_id, job)
+    if next_run:
+        logging.info(
+            "Scheduled job %s for chat %s at %s (%s) on days %s, next run %s UTC",
+            job["id"], chat_id, job["time"], get_channel_tz_name(chat_id), tuple(job["days"]), next_run,
+        )
+
+
+def _build_fire_tables(jobs: List[Tuple[int, dict]]):
+    for chat_id, job in jobs:
+        refresh_fire_table(chat_id, job)
+
+
+async def schedule_new_jobs(application: Application, jobs: List[Tuple[int, dict]]):
+    """جدولة رسائل جديدة دفعة واحدة (زي الاستيراد). الـ ids جديدة فمفيش jobs قديمة نشيلها من job_queue.
+    حساب جداول الأوقات بيتم في thread والجدولة على دفعات عشان منوقفش باقي البوت"""
+    active = [(chat_id, job) for chat_id, job in jobs if not job.get("paused", False)]
+    await asyncio.to_thread(_build_fire_tables, active)
+
+    scheduled = 0
+    for k, (chat_id, job) in enumerate(active, start=1):
+        if _queue_first_fire(application, chat_id, job):
+            scheduled += 1
+        if k % SCHEDULE_CHUNK_SIZE == 0:
+            await asyncio.sleep(0)
+    logging.info("Scheduled %d of %d new jobs", scheduled, len(jobs))
 
 
 def unschedule_job(application: Application, chat_id: int, job_id: int):
@@ -172,6 +970,7 @@ def unschedule_job(application: Application, chat_id: int, job_id: int):
     for j in application.job_queue.get_jobs_by_name(name):
         j.schedule_removal()
         removed += 1
+    index_remove(chat_id, job_id)
     logging.info("Removed %d scheduled jobs named %s", removed, name)
 
 
@@ -188,7 +987,7 @@ async def check_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id:
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     keyboard = get_main_menu(user_id)
-    text = "مرحبا! أنا بوت الجدولة 🤖\nاضفني في قناة → ثم ابعت /start\n\n⏰ التوقيت: القاهرة (Africa/Cairo)"
+    text = "مرحبا! أنا بوت الجدولة 🤖\nاضفني في قناة → ثم ابعت /start\n\n⏰ التوقيت: حسب المنطقة الزمنية لكل قناة (الافتراضي: القاهرة)"
     if not keyboard.inline_keyboard:
         text += "\n\nلا توجد قنوات متفعلة بعد."
     if update.message:
@@ -210,12 +1009,80 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "✅ تعديل الرسائل\n"
         "✅ إيقاف مؤقت للرسائل\n"
         "✅ نظام 12 ساعة (صباحاً/مساءً)\n"
-        "⏰ التوقيت: القاهرة (Africa/Cairo)\n\n"
+        "✅ منطقة زمنية لكل قناة (الافتراضي: القاهرة)\n"
+        "✅ استيراد/تصدير الرسائل (JSONL أو CSV)\n"
+        "✅ قوالب: {date} {weekday_ar} {hijri_date} {counter}\n\n"
+        "الأوامر:\n"
+        "/upcoming [chat_id] - المنشورات خلال 24 ساعة\n"
+        "/import <chat_id> - استيراد رسائل من ملف\n"
+        "/export <chat_id> [csv] - تصدير رسائل القناة\n\n"
         "الرسائل هترسل تلقائي كل أسبوع في الأيام والوقت اللي تختارهم."
     )
     await update.message.reply_text(text)
 
 
+async def upcoming_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if context.args:
+        try:
+            chat_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("الاستخدام: /upcoming [chat_id]")
+            return
+        if not await check_admin(context, chat_id, user_id):
+            await update.message.reply_text("لازم تكون أدمن في القناة عشان تشوف منشوراتها.")
+            return
+        chat_ids = [chat_id]
+    else:
+        # التحقق من كل القنوات في نفس الوقت بدل طلب ورا التاني
+        candidates = list(CHANNELS)
+        results = await asyncio.gather(*(check_admin(context, cid, user_id) for cid in candidates))
+        chat_ids = [cid for cid, is_admin in zip(candidates, results) if is_admin]
+        if not chat_ids:
+            await update.message.reply_text("مش أدمن في أي قناة متفعلة.")
+            return
+
+    entries = upcoming_fires(chat_ids)
+    if not entries:
+        await update.message.reply_text("لا توجد منشورات خلال 24 ساعة.")
+        return
+    await update.message.reply_text(
+        "🗓️ المنشورات خلال 24 ساعة:\n\n" + format_upcoming(entries, show_channel=len(chat_ids) > 1)
+    )
+
+
+async def import_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    try:
+        chat_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("الاستخدام: /import <chat_id>")
+        return
+
+    if not await check_admin(context, chat_id, user_id):
+        await update.message.reply_text("لازم تكون أدمن في القناة عشان تستورد رسائل.")
+        return
+
+    USER_STATE[user_id] = {"step": "wait_import", "chat_id": chat_id}
+    await update.message.reply_text(IMPORT_PROMPT)
+
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    try:
+        chat_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("الاستخدام: /export <chat_id> [csv]")
+        return
+
+    if not await check_admin(context, chat_id, user_id):
+        await update.message.reply_text("لازم تكون أدمن في القناة عشان تصدر الرسائل.")
+        return
+
+    fmt = "csv" if len(context.args) > 1 and context.args[1].lower() == "csv" else "jsonl"
+    await send_export(context, update.effective_chat.id, chat_id, fmt)
+
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -229,7 +1096,102 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("select_"):
         chat_id = int(data.split("_", 1)[1])
         title = CHANNELS.get(chat_id, {}).get("title", "قناة")
-        await query.edit_message_text(f"التحكم في: {title}", reply_markup=get_channel_menu(chat_id))
+        await query.edit_message_text(
+            f"التحكم في: {title}\n⏰ التوقيت: {get_channel_tz_name(chat_id)}",
+            reply_markup=get_channel_menu(chat_id),
+        )
+        return
+
+    if data.startswith("import_"):
+        chat_id = int(data.split("_", 1)[1])
+
+        if not await check_admin(context, chat_id, user_id):
+            await query.edit_message_text("لازم تكون أدمن في القناة عشان تستورد رسائل.")
+            return
+
+        USER_STATE[user_id] = {"step": "wait_import", "chat_id": chat_id}
+        await query.edit_message_text(IMPORT_PROMPT)
+        return
+
+    if data.startswith("export_"):
+        chat_id = int(data.split("_", 1)[1])
+
+        if not await check_admin(context, chat_id, user_id):
+            await query.answer("لازم تكون أدمن في القناة", show_alert=True)
+            return
+
+        await send_export(context, query.message.chat_id, chat_id, "jsonl")
+        return
+
+    if data.startswith("timeline_"):
+        chat_id = int(data.split("_", 1)[1])
+        entries = upcoming_fires([chat_id])
+        if entries:
+            msg = "🗓️ المنشورات خلال 24 ساعة:\n\n" + format_upcoming(entries, show_channel=False)
+        else:
+            msg = "لا توجد منشورات خلال 24 ساعة."
+        keyboard = [[InlineKeyboardButton("رجوع", callback_data=f"select_{chat_id}")]]
+        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    if data.startswith("stats_"):
+        chat_id = int(data.split("_", 1)[1])
+        totals = JOB_TOTALS.get(chat_id, {})
+        jobs_by_id = {j["id"]: j for j in CHANNELS.get(chat_id, {}).get("jobs", [])}
+        lines = []
+        for job_id in sorted(totals)[:STATS_MAX_JOBS]:
+            sent, failed, latency = totals[job_id]
+            job = jobs_by_id.get(job_id)
+            if job:
+                label = job["text"][:20] + "..." if len(job["text"]) > 20 else job["text"]
+            else:
+                label = "(محذوفة)"
+            avg = f" — ⏱ {latency / sent / 1000:.1f}ث" if sent else ""
+            lines.append(f"#{job_id} {label}\n✅ {sent} ❌ {failed}{avg}")
+        msg = "📊 الإحصائيات:\n\n" + "\n\n".join(lines) if lines else "لا توجد إحصائيات بعد."
+        if len(totals) > STATS_MAX_JOBS:
+            msg += f"\n\n... و{len(totals) - STATS_MAX_JOBS} رسالة أخرى"
+        keyboard = [[InlineKeyboardButton("رجوع", callback_data=f"select_{chat_id}")]]
+        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    if data.startswith("tz_"):
+        chat_id = int(data.split("_", 1)[1])
+        current = get_channel_tz_name(chat_id)
+        keyboard = []
+        for idx, tz_name in enumerate(COMMON_TIMEZONES):
+            label = tz_name + (" ✅" if tz_name == current else "")
+            keyboard.append([InlineKeyboardButton(label, callback_data=f"settz_{chat_id}_{idx}")])
+        keyboard.append([InlineKeyboardButton("رجوع", callback_data=f"select_{chat_id}")])
+        await query.edit_message_text(
+            f"المنطقة الزمنية الحالية: {current}\nاختر المنطقة الزمنية للقناة:",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+        return
+
+    if data.startswith("settz_"):
+        _, chat_id_s, idx_s = data.split("_")
+        chat_id, idx = int(chat_id_s), int(idx_s)
+
+        if not await check_admin(context, chat_id, user_id):
+            await query.answer("لازم تكون أدمن في القناة", show_alert=True)
+            return
+
+        if chat_id not in CHANNELS or not 0 <= idx < len(COMMON_TIMEZONES):
+            await query.edit_message_text("القناة غير موجودة.")
+            return
+
+        tz_name = COMMON_TIMEZONES[idx]
+        CHANNELS[chat_id]["tz"] = tz_name
+        save_data()
+        for job in CHANNELS[chat_id]["jobs"]:
+            if not job.get("paused", False):
+                schedule_job(context.application, chat_id, job)
+
+        await query.edit_message_text(
+            f"تم تغيير المنطقة الزمنية إلى {tz_name} ✅",
+            reply_markup=get_channel_menu(chat_id),
+        )
         return
 
     if data.startswith("addmsg_"):
@@ -242,7 +1204,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         USER_STATE[user_id] = {"step": "wait_text", "chat_id": chat_id, "edit_mode": False}
         await query.edit_message_text(
             "اكتب نص الرسالة اللي عايز تتبعت.\n\n"
-            "أو ابعت صورة مع نص لنشر صورة مع نص في نفس الرسالة."
+            "أو ابعت صورة مع نص لنشر صورة مع نص في نفس الرسالة.\n\n"
+            + TEMPLATE_HELP
         )
         return
 
@@ -278,7 +1241,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_12h = format_time_12h(job['time'].hour, job['time'].minute)
         status = "متوقفة مؤقتاً ⏸️" if job.get("paused") else "نشطة ✅"
         photo_status = "\n📷 تحتوي على صورة" if job.get("photo") else ""
-        msg = f"الرسالة:\n{job['text']}\n\nالوقت: {time_12h} (توقيت القاهرة)\nالأيام: {days}\nالحالة: {status}{photo_status}"
+        msg = f"الرسالة:\n{job['text']}\n\nالوقت: {time_12h} ({get_channel_tz_name(chat_id)})\nالأيام: {days}\nالحالة: {status}{photo_status}"
         
         keyboard = [
             [InlineKeyboardButton("إرسال الآن", callback_data=f"sendnow_{chat_id}_{job_id}")],
@@ -364,7 +1327,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "edit_mode": True, 
             "edit_job_id": job_id
         }
-        await query.edit_message_text("اكتب النص الجديد للرسالة:")
+        await query.edit_message_text("اكتب النص الجديد للرسالة:\n\n" + TEMPLATE_HELP)
         return
 
     if data.startswith("edit_time_"):
@@ -462,12 +1425,29 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not job:
             await query.edit_message_text("الرسالة غير موجودة.")
             return
-        
-        if job.get("photo"):
-            await context.bot.send_photo(chat_id=chat_id, photo=job["photo"], caption=job["text"])
-        else:
-            await context.bot.send_message(chat_id=chat_id, text=job["text"])
-        
+
+        text = job["text"]
+        template = job.get("template")
+        counter = JOB_COUNTERS.get((chat_id, job_id), 0) + 1
+        if template:
+            today = datetime.now(pytz.timezone(get_channel_tz_name(chat_id))).date()
+            text = render_template(template, today, counter)
+
+        try:
+            if job.get("photo"):
+                message = await context.bot.send_photo(chat_id=chat_id, photo=job["photo"], caption=text)
+            else:
+                message = await context.bot.send_message(chat_id=chat_id, text=text)
+        except Exception as e:
+            logging.error("فشل إرسال الرسالة للـchat %s : %s", chat_id, e)
+            record_delivery(chat_id, job_id, None, None, False)
+            await query.edit_message_text("فشل الإرسال ❌")
+            return
+
+        record_delivery(chat_id, job_id, None, message.message_id, True)
+        if template and template[3]:
+            JOB_COUNTERS[(chat_id, job_id)] = counter
+            COUNTERS_STATE["dirty"] = True
         await query.edit_message_text("تم الإرسال فورًا! ✅")
         return
 
@@ -492,6 +1472,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         job = next((j for j in CHANNELS[chat_id]["jobs"] if j["id"] == job_id), None)
         if job:
             unschedule_job(context.application, chat_id, job_id)
+            FIRE_TABLES.pop(f"{chat_id}_{job_id}", None)
+            JOB_COUNTERS.pop((chat_id, job_id), None)
             CHANNELS[chat_id]["jobs"].remove(job)
             save_data()
             await query.edit_message_text("تم الحذف! 🗑️", reply_markup=get_channel_menu(chat_id))
@@ -632,6 +1614,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if job:
                 unschedule_job(context.application, chat_id, job_id)
                 job["text"] = text
+                job["template"] = compile_template(text)
                 job["photo"] = photo
                 job["time"] = dtime(hour_24, minute)
                 job["days"] = tuple(days)
@@ -645,8 +1628,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await query.edit_message_text("الرسالة غير موجودة.")
         else:
-            existing = CHANNELS.setdefault(chat_id, {"title": f"قناة_{chat_id}", "jobs": []})["jobs"]
-            new_id = max((j["id"] for j in existing), default=0) + 1
+            CHANNELS.setdefault(chat_id, {"title": f"قناة_{chat_id}", "tz": DEFAULT_TZ_NAME, "jobs": []})
+            new_id = allocate_job_id(chat_id)
             job_obj = {
                 "id": new_id, 
                 "text": text, 
@@ -654,7 +1637,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "time": dtime(hour_24, minute), 
                 "days": tuple(days), 
                 "user_id": user_id,
-                "paused": False
+                "paused": False,
+                "template": compile_template(text),
             }
             CHANNELS[chat_id]["jobs"].append(job_obj)
             save_data()
@@ -698,6 +1682,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if job:
             unschedule_job(context.application, chat_id, job_id)
             job["text"] = text
+            job["template"] = compile_template(text)
             job["photo"] = photo
             save_data()
             
@@ -719,6 +1704,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("اختر الفترة:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
+async def send_export(context: ContextTypes.DEFAULT_TYPE, to_chat_id: int, chat_id: int, fmt: str):
+    """تصدير رسائل القناة لملف مؤقت على الديسك وإرساله كمستند"""
+    with tempfile.TemporaryFile() as raw:
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        count = export_jobs(out, fmt, chat_id)
+        out.flush()
+        out.detach()
+        raw.seek(0)
+        await context.bot.send_document(
+            chat_id=to_chat_id,
+            document=raw,
+            filename=f"jobs_{chat_id}.{fmt}",
+            caption=f"تم تصدير {count} رسالة ✅",
+        )
+
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message or not update.message.document:
+        return
+
+    user_id = update.effective_user.id
+    state = USER_STATE.get(user_id)
+    if not state or state.get("step") != "wait_import":
+        return
+
+    chat_id = state["chat_id"]
+    document = update.message.document
+    fmt = detect_format(document.file_name or "")
+
+    fd, tmp_path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(custom_path=tmp_path)
+        added, duplicates, errors = await asyncio.to_thread(read_import_file, tmp_path, fmt, chat_id, user_id)
+    except Exception as e:
+        logging.error("فشل استيراد الملف: %s", e)
+        await update.message.reply_text("فشل قراءة الملف. اتأكد إنه JSONL أو CSV بترميز UTF-8.")
+        return
+    finally:
+        os.remove(tmp_path)
+
+    if added:
+        # التعديل على CHANNELS هنا في الـ loop، والكتابة على الديسك بس في thread
+        undo = apply_import(added)
+        if not await asyncio.to_thread(write_data, *serialize_data()):
+            undo()
+            errors.append(IMPORT_SAVE_ERROR)
+            added = []
+    await schedule_new_jobs(context.application, added)
+
+    USER_STATE.pop(user_id, None)
+    msg = f"تم استيراد {len(added)} رسالة ✅\nمكرر (تم تجاهله): {duplicates}\nأخطاء: {len(errors)}"
+    if errors:
+        msg += "\n\n" + "\n".join(errors[:10])
+        if len(errors) > 10:
+            msg += f"\n... و{len(errors) - 10} غيرهم"
+    await update.message.reply_text(msg, reply_markup=get_channel_menu(chat_id))
+
+
 async def new_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -728,19 +1773,59 @@ async def new_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
             chat_id = chat.id
             title = chat.title or chat.username or "قناة"
             if chat_id not in CHANNELS:
-                CHANNELS[chat_id] = {"title": title, "jobs": []}
+                CHANNELS[chat_id] = {"title": title, "tz": DEFAULT_TZ_NAME, "jobs": []}
                 save_data()
             await update.message.reply_text(f"تم التفعيل في {title}!\nافتح الشات الخاص وابعت /start")
             logging.info("Bot added to chat %s (%s)", chat_id, title)
 
 
+def run_cli(argv: List[str]) -> int:
+    """استيراد/تصدير من سطر الأوامر (البوت لازم يكون واقف عشان ميكتبش فوق data.json):
+    python main.py import jobs.jsonl [chat_id]
+    python main.py export jobs.csv [chat_id]"""
+    if len(argv) < 2:
+        print(run_cli.__doc__)
+        return 2
+
+    command, path = argv[0], argv[1]
+    chat_id = int(argv[2]) if len(argv) > 2 else None
+    fmt = detect_format(path)
+
+    if command == "import":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            added, duplicates, errors = import_jobs(f, fmt, chat_id)
+        for err in errors:
+            print(err, file=sys.stderr)
+        print(f"imported={len(added)} duplicates={duplicates} errors={len(errors)}")
+        return 1 if errors and not added else 0
+
+    if command == "export":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            count = export_jobs(f, fmt, chat_id)
+        print(f"exported={count}")
+        return 0
+
+    print(run_cli.__doc__)
+    return 2
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("import", "export"):
+        sys.exit(run_cli(sys.argv[1:]))
+
+    if not TOKEN:
+        raise RuntimeError("خطأ: التوكن مش موجود في متغير البيئة TELEGRAM_BOT_TOKEN")
+
     app = Application.builder().token(TOKEN).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
+    app.add_handler(CommandHandler("upcoming", upcoming_cmd))
+    app.add_handler(CommandHandler("import", import_cmd))
+    app.add_handler(CommandHandler("export", export_cmd))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(MessageHandler(filters.PHOTO, handle_message))
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_member))
 
     for cid, info in CHANNELS.items():
@@ -750,8 +1835,14 @@ def main():
             except Exception as e:
                 logging.error("فشل جدولة job %s in chat %s: %s", job.get("id"), cid, e)
 
-    logging.info("البوت شغال! يبدأ polling... (توقيت القاهرة)")
+    app.job_queue.run_repeating(flush_state_callback, interval=STATS_FLUSH_SECONDS, name="state_flush")
+    app.job_queue.run_daily(prune_history_callback, time=dtime(3, 0, tzinfo=pytz.utc), name="history_prune")
+
+    logging.info("البوت شغال! يبدأ polling...")
     app.run_polling()
+    save_stats()
+    if COUNTERS_STATE["dirty"]:
+        save_data()
 
 
 if __name__ == "__main__":